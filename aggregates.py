@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Materialized per-stock and per-date aggregates of the comparison events.
+
+回答「2330 創了幾次新高、第一次與最後一次是哪天」原本必須掃描全部事件。
+High/Low 分析程式在輸出比較結果時，同時把事件彙整到共用的
+``output/台股創新高低統計.json``：
+
+    stocks.{high,low}.{code}  事件次數、第一次/最後一次日期、最大超越基準幅度
+    dates.{date}              當天創新高與創新低的家數 (市場廣度)；
+                              尚未執行的類別不會出現在該日期中
+
+每次執行都以完整的比較結果重建該類別 (另一類別保持不變)，因此補上先前
+缺漏的日期或調整基準期間後，統計一定與比較結果一致；``through`` 與
+``base`` 記錄最後一個比較日期與基準期間。兩個分析程式以檔案鎖加原子寫入
+共用此檔。
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, List
+
+from cache_io import atomic_write_json, file_lock
+from leaderboard import KINDS, beyond_pct
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+AGGREGATES_FILE = os.path.join(OUTPUT_DIR, '台股創新高低統計.json')
+VERSION = 1
+
+
+def empty_aggregates() -> Dict[str, Any]:
+    return {
+        'version': VERSION,
+        'through': {kind: None for kind in KINDS},
+        'base': {kind: None for kind in KINDS},
+        'stocks': {kind: {} for kind in KINDS},
+        'dates': {},
+    }
+
+
+def load_aggregates(path: str = AGGREGATES_FILE) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return empty_aggregates()
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != VERSION:
+        logging.warning("統計檔版本不符，重新建立: %s", path)
+        return empty_aggregates()
+    return data
+
+
+def reset_kind(data: Dict[str, Any], kind: str) -> None:
+    data['through'][kind] = None
+    data['stocks'][kind] = {}
+    for date in list(data['dates']):
+        data['dates'][date].pop(kind, None)
+        if not data['dates'][date]:
+            del data['dates'][date]
+
+
+def fold_events(data: Dict[str, Any], kind: str, results: List[Dict[str, Any]],
+                dates: Iterable[str]) -> List[str]:
+    """以比較結果重建該類別的統計，回傳彙整的日期
+
+    ``dates`` 為本次比較期間有資料的日期；沒有事件的日期也會記錄為 0 家。
+    """
+    reset_kind(data, kind)
+    new_dates = sorted(set(dates) | {item['date'] for item in results})
+    if not new_dates:
+        return []
+    stocks = data['stocks'][kind]
+    breadth = data['dates']
+    for date in new_dates:
+        breadth.setdefault(date, {})[kind] = 0
+
+    for event in sorted(results, key=lambda item: (item['date'], item['code'])):
+        date = event['date']
+        extension = round(beyond_pct(kind, event[kind], event[f'base_{kind}']), 2)
+        stock = stocks.get(event['code'])
+        if stock is None:
+            stocks[event['code']] = {
+                'name': event['name'],
+                'count': 1,
+                'first': date,
+                'last': date,
+                'max_extension_pct': extension,
+                'max_extension_date': date,
+            }
+        else:
+            stock['name'] = event['name']
+            stock['count'] += 1
+            stock['last'] = date
+            if extension > stock['max_extension_pct']:
+                stock['max_extension_pct'] = extension
+                stock['max_extension_date'] = date
+        breadth[date][kind] += 1
+
+    data['through'][kind] = new_dates[-1]
+    return new_dates
+
+
+def update_aggregates(kind: str, results: List[Dict[str, Any]], dates: Iterable[str],
+                      base: str, path: str = AGGREGATES_FILE) -> List[str]:
+    """在檔案鎖內讀取、重建該類別並原子寫回統計檔，回傳彙整的日期
+
+    Args:
+        results: 本次完整的比較結果
+        base: 基準期間 (例如 ``20250407-20250525``)
+    """
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {KINDS}, got {kind!r}')
+    with file_lock(path):
+        data = load_aggregates(path)
+        folded = fold_events(data, kind, results, dates)
+        data['base'][kind] = base
+        data['stocks'][kind] = dict(sorted(data['stocks'][kind].items()))
+        data['dates'] = dict(sorted(data['dates'].items()))
+        atomic_write_json(path, data)
+    return folded
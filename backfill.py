@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Resumable backfill of TWSE daily data into the high and low caches.
+
+一次 MI_INDEX 下載同時包含最高價與最低價欄位，因此補資料時每個日期只
+請求一次，並同時寫入 ``cache_high`` 與 ``cache_low``。
+
+每個日期的狀態記錄在 ``output/backfill_state.json`` (checkpoint)：
+
+    done    已下載並寫入快取
+    empty   交易所回傳空內容 (休市日)，之後不再請求；只有早於今天的日期
+            才會記錄為 empty，今天以後或回應內容無法解析時記為 failed
+    failed  重試仍失敗，記錄嘗試次數與最後錯誤
+
+程式中斷後重新執行會從 checkpoint 繼續。下載失敗時以指數退避加隨機抖動
+重試；遇到 HTTP 429/503 時依 ``Retry-After`` 與目前間隔加倍放慢請求速度，
+之後每次成功再逐步加快。
+
+    python backfill.py 20230101 20250620
+    python backfill.py 20230101 20250620 --source fixture:throttle_rate=0.2 --min-interval 0
+"""
+
+import argparse
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+import data_sources
+import log_utils
+import tse_stock_price_analyzer_high as high_analyzer
+import tse_stock_price_analyzer_low as low_analyzer
+from backfill_state import (
+    STATE_FILE, STATUS_DONE, STATUS_EMPTY, STATUS_FAILED, BackfillState,
+)
+from data_sources import DataSourceError
+
+OUTPUT_DIR = high_analyzer.OUTPUT_DIR
+LOG_FILE = os.path.join(OUTPUT_DIR, 'backfill.log')
+
+THROTTLE_STATUSES = (429, 503)
+# 這些狀態碼重試也不會成功
+PERMANENT_STATUSES = (400, 401, 403, 404, 410)
+
+ANALYZERS = (high_analyzer, low_analyzer)
+
+
+class IncompleteDayError(Exception):
+    """下載成功但未能完整寫入兩個快取"""
+
+
+class AdaptiveThrottle:
+    """控制請求間隔：被限流時放慢 (至少 Retry-After)，成功時逐步加快"""
+
+    def __init__(self, min_interval: float = 1.0, max_interval: float = 60.0,
+                 slowdown: float = 1.5, speedup: float = 0.8,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.slowdown = slowdown
+        self.speedup = speedup
+        self.interval = min_interval
+        self.sleep = sleep
+        self.last_request = 0.0
+
+    def wait(self) -> None:
+        remaining = self.last_request + self.interval - time.monotonic()
+        if remaining > 0:
+            self.sleep(remaining)
+        self.last_request = time.monotonic()
+
+    def on_success(self) -> None:
+        self.interval = max(self.min_interval, self.interval * self.speedup)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        slower = max(self.interval * self.slowdown, self.min_interval, 0.5)
+        self.interval = min(self.max_interval, max(slower, retry_after or 0.0))
+        logging.warning("被交易所限流，請求間隔調整為 %.1f 秒", self.interval)
+
+
+def backoff_delay(attempt: int, base: float, cap: float,
+                  retry_after: Optional[float] = None,
+                  rng: Optional[random.Random] = None) -> float:
+    """指數退避加 full jitter；有 Retry-After 時至少等待該秒數"""
+    rng = rng or random
+    delay = rng.uniform(0, min(cap, base * (2 ** attempt)))
+    return max(delay, retry_after or 0.0)
+
+
+def run_backfill(dates: Iterable[str],
+                 fetch: Callable[[str], str],
+                 handle: Callable[[str, str], int],
+                 state: BackfillState,
+                 throttle: AdaptiveThrottle,
+                 max_attempts: int = 6,
+                 backoff_base: float = 1.0,
+                 backoff_cap: float = 60.0,
+                 skip: Callable[[str], bool] = lambda date: False,
+                 sleep: Callable[[float], None] = time.sleep,
+                 rng: Optional[random.Random] = None,
+                 today: Optional[str] = None) -> Dict[str, int]:
+    """依序補齊日期，每個日期處理完就寫入 checkpoint，回傳各狀態的數量
+
+    Args:
+        fetch: 下載指定日期的原始內容，失敗時丟出 DataSourceError
+        handle: 解析並寫入快取，回傳資料筆數 (0 代表休市)；未能完整寫入時
+            丟出 IncompleteDayError
+        skip: 已有快取的日期回傳 True，直接標記完成而不發出請求
+        today: YYYYMMDD，此日 (含) 之後沒有資料時記為 failed 而非休市
+    """
+    today = today or datetime.now().strftime('%Y%m%d')
+    summary = {STATUS_DONE: 0, STATUS_EMPTY: 0, STATUS_FAILED: 0, 'skipped': 0, 'requests': 0}
+    for date in dates:
+        if state.status(date) == STATUS_DONE or state.confirmed_empty(date):
+            summary['skipped'] += 1
+            continue
+        if skip(date):
+            state.mark(date, STATUS_DONE, state.attempts(date))
+            state.save()
+            summary['skipped'] += 1
+            continue
+
+        # attempts 為累計嘗試次數 (含先前執行)，tries 為本次執行的嘗試次數
+        attempts = state.attempts(date)
+        tries = 0
+        while True:
+            throttle.wait()
+            attempts += 1
+            tries += 1
+            summary['requests'] += 1
+            try:
+                text = fetch(date)
+            except DataSourceError as exc:
+                if exc.status in THROTTLE_STATUSES:
+                    throttle.on_throttle(exc.retry_after)
+                if exc.status in PERMANENT_STATUSES or tries >= max_attempts:
+                    logging.error("補資料失敗 %s (第 %d 次): %s", date, attempts, exc)
+                    state.mark(date, STATUS_FAILED, attempts, error=str(exc))
+                    summary[STATUS_FAILED] += 1
+                    break
+                delay = backoff_delay(tries - 1, backoff_base, backoff_cap, exc.retry_after, rng)
+                logging.warning("下載 %s 失敗 (第 %d 次)，%.1f 秒後重試: %s",
+                                date, attempts, delay, exc)
+                sleep(delay)
+                continue
+
+            throttle.on_success()
+            try:
+                count = handle(date, text)
+            except IncompleteDayError as exc:
+                logging.error("補資料失敗 %s: %s", date, exc)
+                state.mark(date, STATUS_FAILED, attempts, error=str(exc))
+                summary[STATUS_FAILED] += 1
+                break
+            if not count and date >= today:
+                # 交易所可能尚未公布當天 (或之後) 的資料，下次再試
+                logging.warning("補資料 %s: 尚無資料", date)
+                state.mark(date, STATUS_FAILED, attempts, error='no data published yet')
+                summary[STATUS_FAILED] += 1
+                break
+            status = STATUS_DONE if count else STATUS_EMPTY
+            state.mark(date, status, attempts, records=count)
+            summary[status] += 1
+            logging.info("補資料 %s: %s (%d 筆)", date, status, count)
+            break
+        state.save()
+    return summary
+
+
+def fetch_twse(source: data_sources.DataSource) -> Callable[[str], str]:
+    def fetch(date: str) -> str:
+        content = source.get(high_analyzer.BASE_URL.format(date=date), timeout=10)
+        return content.decode('cp950', errors='ignore')
+    return fetch
+
+
+def save_both(date: str, text: str) -> int:
+    """以 high/low 兩個分析程式的 parse_csv 解析同一份 CSV 並各自寫入快取
+
+    回應內容為空時回傳 0 (休市)；內容不是可解析的 CSV (例如限流時的說明頁)、
+    只有一邊有資料或寫入快取失敗時丟出 IncompleteDayError，該日期會標記為
+    失敗，下次執行再重試。
+    """
+    parsed = [(analyzer, analyzer.parse_csv(text)) for analyzer in ANALYZERS]
+    counts = [len(records) for _, records in parsed]
+    if not any(counts):
+        if text.strip():
+            raise IncompleteDayError(f'no records in a {len(text)}-character response')
+        return 0
+    if not all(counts):
+        raise IncompleteDayError(f'parsed records per cache: {counts}')
+    for analyzer, records in parsed:
+        if not analyzer.save_cache_data(date, records):
+            raise IncompleteDayError(f'failed to write {analyzer.CACHE_DIR}')
+        analyzer.save_downloaded_date(date)
+    return min(counts)
+
+
+def already_cached(date: str) -> bool:
+    return all(analyzer.load_cache_data(date) for analyzer in ANALYZERS)
+
+
+def setup_logging(json_logs: bool = False) -> None:
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if json_logs:
+        # 背景 queue 寫入輪替的 JSON Lines，逐日訊息彙整為進度摘要
+        log_utils.setup_queue_logging(os.path.splitext(LOG_FILE)[0] + '.jsonl')
+        return
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding='utf-8'),
+            logging.StreamHandler(),
+        ],
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='補齊指定期間的上市股票每日資料 (可中斷後續傳)')
+    parser.add_argument('start', help='起始日期 YYYYMMDD')
+    parser.add_argument('end', help='結束日期 YYYYMMDD')
+    parser.add_argument('--source', default=None,
+                        help='資料來源，格式同分析程式的 --source')
+    parser.add_argument('--state', default=STATE_FILE, help='checkpoint 檔案 (預設 %(default)s)')
+    parser.add_argument('--max-attempts', type=int, default=6,
+                        help='每次執行中每個日期最多嘗試次數 (失敗的日期下次執行會再重試)')
+    parser.add_argument('--min-interval', type=float, default=3.0,
+                        help='請求之間的最短間隔秒數 (預設 %(default)s)')
+    parser.add_argument('--retry-empty', action='store_true',
+                        help='重新檢查先前判定為休市的日期')
+    parser.add_argument('--log-json', action='store_true',
+                        help='以背景執行緒寫入輪替的 JSON Lines log，逐日訊息彙整為進度摘要')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    setup_logging(args.log_json)
+    source = data_sources.create_source(args.source) if args.source else high_analyzer.SOURCE
+
+    state = BackfillState(args.state)
+    if args.retry_empty:
+        for date in state.with_status(STATUS_EMPTY):
+            del state.dates[date]
+    dates = high_analyzer.generate_dates(args.start, args.end)
+    logging.info("補資料期間 %s ~ %s，共 %d 個平日 (checkpoint: %s)",
+                 args.start, args.end, len(dates), args.state)
+
+    started = time.monotonic()
+    try:
+        summary = run_backfill(
+            dates, fetch_twse(source), save_both, state,
+            AdaptiveThrottle(min_interval=args.min_interval),
+            max_attempts=args.max_attempts,
+            skip=already_cached,
+        )
+    except KeyboardInterrupt:
+        state.save()
+        logging.info("已中斷，重新執行即可從 checkpoint 繼續")
+        return
+    logging.info("補資料完成 (%.0f 秒): 新下載 %d、休市 %d、失敗 %d、略過 %d，共 %d 次請求",
+                 time.monotonic() - started, summary[STATUS_DONE], summary[STATUS_EMPTY],
+                 summary[STATUS_FAILED], summary['skipped'], summary['requests'])
+    if summary[STATUS_FAILED]:
+        logging.warning("失敗的日期: %s", ', '.join(
+            d for d in state.with_status(STATUS_FAILED) if d in set(dates)))
+
+
+if __name__ == '__main__':
+    main()
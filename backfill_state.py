@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Per-date checkpoint of ``backfill.py``.
+
+與補資料程式分開，分析程式只需讀取已確認休市的日期，不必匯入
+``backfill`` (它會匯入兩個分析程式)。
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from cache_io import atomic_write_json, file_lock
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+STATE_FILE = os.path.join(OUTPUT_DIR, 'backfill_state.json')
+
+STATUS_DONE = 'done'
+STATUS_EMPTY = 'empty'
+STATUS_FAILED = 'failed'
+
+
+class BackfillState:
+    """每個日期的下載狀態，以 JSON 檔保存 (原子寫入)"""
+
+    def __init__(self, path: str = STATE_FILE) -> None:
+        self.path = path
+        self.dates: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    def load(self) -> None:
+        with file_lock(self.path):
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.dates = json.load(f).get('dates', {})
+
+    def save(self) -> None:
+        with file_lock(self.path):
+            atomic_write_json(self.path, {'version': 1, 'dates': dict(sorted(self.dates.items()))})
+
+    def status(self, date: str) -> Optional[str]:
+        return self.dates.get(date, {}).get('status')
+
+    def attempts(self, date: str) -> int:
+        return self.dates.get(date, {}).get('attempts', 0)
+
+    def mark(self, date: str, status: str, attempts: int,
+             error: Optional[str] = None, records: Optional[int] = None) -> None:
+        entry = {
+            'status': status,
+            'attempts': attempts,
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }
+        if error:
+            entry['error'] = error
+        if records is not None:
+            entry['records'] = records
+        self.dates[date] = entry
+
+    def with_status(self, status: str) -> List[str]:
+        return sorted(d for d, e in self.dates.items() if e.get('status') == status)
+
+    def confirmed_empty(self, date: str) -> bool:
+        """是否為確認的休市日：必須是在該日期之後才記錄的 empty
+
+        當天或之後記錄的 empty 可能只是交易所尚未公布資料，視為未確認。
+        """
+        entry = self.dates.get(date, {})
+        if entry.get('status') != STATUS_EMPTY:
+            return False
+        recorded = entry.get('updated', '')[:10].replace('-', '')
+        return bool(recorded) and date < recorded
+
+
+def empty_dates(path: str = STATE_FILE) -> set:
+    """回傳 checkpoint 中已確認為休市的日期，分析程式可直接略過"""
+    if not os.path.exists(path):
+        return set()
+    try:
+        state = BackfillState(path)
+        return {d for d in state.with_status(STATUS_EMPTY) if state.confirmed_empty(d)}
+    except Exception as e:
+        logging.warning("讀取補資料狀態失敗 %s: %s", path, e)
+        return set()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Process-safe primitives for the per-date cache and download ledger.
+
+多個分析程式 (high/low/backfill) 可能同時讀寫同一個 ``output`` 目錄：
+
+* ``atomic_write_json`` 先寫入同目錄的暫存檔再 ``os.replace``，讀取端只會
+  看到舊檔或完整的新檔，不會讀到寫到一半的 JSON。
+* ``file_lock`` 以旁邊的 ``.lock`` 檔做跨程序互斥鎖 (POSIX 用 ``fcntl``，
+  Windows 用 ``msvcrt``)，用來保護 ``downloaded_dates_*.txt`` 的讀寫。
+* ``load_json_records`` 檢查快取內容是否為完整且欄位齊全的記錄清單。
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class InvalidCacheError(ValueError):
+    """快取檔案內容不完整或格式不符"""
+
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """對 ``path + '.lock'`` 取得獨占鎖，離開 with 區塊時釋放"""
+    lock_path = path + '.lock'
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # msvcrt.LK_LOCK 只會重試約 10 秒，逾時後持續重試直到取得鎖
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_text(path: str, text: str) -> None:
+    """以暫存檔加 rename 的方式寫入文字檔"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp 建立的檔案權限為 0600，調整為一般檔案權限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, data: Any) -> None:
+    """以原子方式寫入 JSON 檔案"""
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+def load_json_records(path: str,
+                      required_keys: Sequence[str] = ()) -> Optional[List[Dict[str, Any]]]:
+    """讀取並檢查快取 JSON；檔案不存在時回傳 None
+
+    Raises:
+        InvalidCacheError: 內容無法解析、不是記錄清單，或缺少必要欄位
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as exc:
+        raise InvalidCacheError(f'{path}: {exc}') from exc
+    if not isinstance(data, list):
+        raise InvalidCacheError(f'{path}: expected a list, got {type(data).__name__}')
+    for item in data:
+        if not isinstance(item, dict) or any(key not in item for key in required_keys):
+            raise InvalidCacheError(f'{path}: record missing one of {list(required_keys)}')
+    return data
+
+
+def read_ledger(path: str) -> set:
+    """在鎖內讀取已下載日期記錄檔"""
+    with file_lock(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+
+
+def append_ledger(path: str, entry: str) -> bool:
+    """在鎖內追加一筆記錄；已存在時不重複寫入，回傳是否有寫入"""
+    with file_lock(path):
+        existing = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                existing = {line.strip() for line in f if line.strip()}
+        if entry in existing:
+            return False
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(f"{entry}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+
+def remove_from_ledger(path: str, entries: Iterable[str]) -> int:
+    """在鎖內從記錄檔移除指定項目 (原子改寫)，回傳移除筆數"""
+    targets = set(entries)
+    with file_lock(path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        kept = [line for line in lines if line not in targets]
+        removed = len(lines) - len(kept)
+        if removed:
+            atomic_write_text(path, ''.join(f"{line}\n" for line in kept))
+        return removed
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Per-date cache with an in-process LRU and a disk retention policy.
+
+``output/cache_high`` 與 ``output/cache_low`` 每個交易日一個 JSON 檔，
+原本會無限成長，且同一個長時間執行的程序每次都重新從磁碟讀取。
+``CacheManager`` 提供：
+
+* 記憶體 LRU：最近使用的日期保留在程序內，受筆數與估計記憶體上限控制，
+  重複分析同一批日期時完全不需讀取磁碟。
+* 磁碟保留策略：依天數 (``max_age_days``) 或起始日期 (``keep_since``)
+  刪除過舊的日期；超過容量上限 (``max_bytes``) 時依 ``policy`` 刪除
+  最舊的日期 (``oldest``) 或最久未使用的日期 (``lru``，以檔案 mtime 記錄
+  最後使用時間)。被刪除的日期會一併從已下載日期記錄檔移除，之後需要時
+  會重新下載。
+
+讀寫磁碟仍透過 ``cache_io`` 的原子寫入與檔案鎖，可與其他分析程序共用。
+"""
+
+import logging
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from cache_io import atomic_write_json, load_json_records, remove_from_ledger
+
+POLICIES = ('oldest', 'lru')
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+
+def estimate_size(records: List[Dict[str, Any]]) -> int:
+    """粗估一天記錄在記憶體中占用的 bytes"""
+    size = sys.getsizeof(records)
+    for rec in records:
+        size += sys.getsizeof(rec)
+        for value in rec.values():
+            size += sys.getsizeof(value)
+    return size
+
+
+class CacheManager:
+    """管理單一快取目錄 (一個日期一個 JSON 檔)"""
+
+    def __init__(self, cache_dir: str, ledger_path: str,
+                 required_keys: Sequence[str] = ()) -> None:
+        self.cache_dir = cache_dir
+        self.ledger_path = ledger_path
+        self.required_keys = tuple(required_keys)
+        self._memory: 'OrderedDict[str, List[Dict[str, Any]]]' = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.configure()
+
+    def configure(self, max_bytes: Optional[int] = None,
+                  max_age_days: Optional[int] = None,
+                  keep_since: Optional[str] = None,
+                  policy: str = 'oldest',
+                  memory_limit: int = DEFAULT_MEMORY_LIMIT,
+                  max_memory_days: Optional[int] = None) -> None:
+        """設定保留策略；未設定的限制代表不限制"""
+        if policy not in POLICIES:
+            raise ValueError(f'policy must be one of {POLICIES}, got {policy!r}')
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.keep_since = keep_since
+        self.policy = policy
+        self.memory_limit = memory_limit
+        self.max_memory_days = max_memory_days
+        self._trim_memory()
+
+    def path_for(self, date: str) -> str:
+        return os.path.join(self.cache_dir, f"{date}.json")
+
+    # ------------------------------------------------------------------
+    # 讀寫
+    # ------------------------------------------------------------------
+    def get(self, date: str) -> Optional[List[Dict[str, Any]]]:
+        """讀取指定日期；先查記憶體，再讀磁碟，都沒有時回傳 None
+
+        Raises:
+            InvalidCacheError: 磁碟上的快取內容不完整
+        """
+        records = self._memory.get(date)
+        if records is not None:
+            self._memory.move_to_end(date)
+            self.hits += 1
+            return records
+        self.misses += 1
+        path = self.path_for(date)
+        records = load_json_records(path, self.required_keys)
+        if records is None:
+            return None
+        if self.policy == 'lru':
+            self._touch(path)
+        self._remember(date, records)
+        return records
+
+    def put(self, date: str, records: List[Dict[str, Any]]) -> None:
+        """原子寫入磁碟並放入記憶體 LRU"""
+        atomic_write_json(self.path_for(date), records)
+        self._remember(date, records)
+
+    def clear_memory(self) -> None:
+        self._memory.clear()
+        self._sizes.clear()
+        self._memory_bytes = 0
+
+    def _touch(self, path: str) -> None:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _remember(self, date: str, records: List[Dict[str, Any]]) -> None:
+        if date in self._memory:
+            self._memory_bytes -= self._sizes.pop(date)
+        size = estimate_size(records)
+        self._memory[date] = records
+        self._sizes[date] = size
+        self._memory_bytes += size
+        self._trim_memory()
+
+    def _trim_memory(self) -> None:
+        while self._memory and (
+            self._memory_bytes > self.memory_limit
+            or (self.max_memory_days is not None and len(self._memory) > self.max_memory_days)
+        ):
+            date, _ = self._memory.popitem(last=False)
+            self._memory_bytes -= self._sizes.pop(date)
+
+    # ------------------------------------------------------------------
+    # 磁碟保留策略
+    # ------------------------------------------------------------------
+    def disk_usage(self) -> Dict[str, os.stat_result]:
+        """回傳 ``{date: stat}``，只包含 YYYYMMDD.json 檔案"""
+        usage = {}
+        if not os.path.isdir(self.cache_dir):
+            return usage
+        for entry in os.scandir(self.cache_dir):
+            name, ext = os.path.splitext(entry.name)
+            if ext == '.json' and len(name) == 8 and name.isdigit() and entry.is_file():
+                usage[name] = entry.stat()
+        return usage
+
+    def enforce_retention(self, protect: Iterable[str] = (),
+                          today: Optional[datetime] = None) -> List[str]:
+        """依設定刪除過期或超出容量的日期，回傳被刪除的日期
+
+        ``protect`` 中的日期 (通常是本次分析需要的日期) 不論天數、起始日期或
+        容量上限都不會被刪除，否則下次分析又得重新下載。
+        """
+        if self.max_bytes is None and self.max_age_days is None and not self.keep_since:
+            return []
+        usage = self.disk_usage()
+        protected = set(protect)
+        expired = set()
+        cutoff = self.keep_since
+        if self.max_age_days is not None:
+            age_cutoff = ((today or datetime.now()) - timedelta(days=self.max_age_days)).strftime('%Y%m%d')
+            cutoff = max(cutoff or '', age_cutoff)
+        if cutoff:
+            expired = {date for date in usage if date < cutoff}
+            kept = expired & protected
+            if kept:
+                logging.warning("保留 %d 個本次分析需要的日期 (早於保留期限 %s)", len(kept), cutoff)
+                expired -= kept
+
+        evicted = sorted(expired)
+        if self.max_bytes is not None:
+            remaining = {d: st for d, st in usage.items() if d not in expired}
+            total = sum(st.st_size for st in remaining.values())
+            if self.policy == 'lru':
+                order = sorted(remaining, key=lambda d: (remaining[d].st_mtime, d))
+            else:
+                order = sorted(remaining)
+            for date in order:
+                if total <= self.max_bytes:
+                    break
+                if date in protected:
+                    continue
+                evicted.append(date)
+                total -= remaining[date].st_size
+            if total > self.max_bytes:
+                logging.warning("快取容量 %d bytes 仍超過上限 %d bytes (保留本次需要的日期)",
+                                total, self.max_bytes)
+
+        if not evicted:
+            return []
+        for date in evicted:
+            try:
+                os.remove(self.path_for(date))
+            except FileNotFoundError:
+                pass
+            if date in self._memory:
+                del self._memory[date]
+                self._memory_bytes -= self._sizes.pop(date)
+        remove_from_ledger(self.ledger_path, evicted)
+        logging.info("快取保留策略刪除 %d 個日期: %s ~ %s",
+                     len(evicted), min(evicted), max(evicted))
+        return sorted(evicted)
@@ -1,14 +1,31 @@
+import gzip
 import json
+import struct
 import zipfile
+from array import array
 import xml.etree.ElementTree as ET
 from datetime import date, timedelta
 import sys
 import os
 import glob
+import shutil
+from collections import defaultdict
 
 NAMESPACE = {'a': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
 BASE_DATE = date(1899, 12, 30)
 
+# 網頁分片資料: output/shards/manifest.json + {high,low}/date/*.json + {high,low}/prefix/*.json
+SHARD_DIR_NAME = 'shards'
+MANIFEST_NAME = 'manifest.json'
+PREFIX_LEN = 2
+KIND_KEYWORDS = {'high': '創新高', 'low': '創新低'}
+
+# 離線版使用的二進位資料包 (gzip 壓縮、欄式儲存，創新高與創新低合併為一個檔案)
+BUNDLE_NAME = '台股創新高低比較.bin.gz'
+BUNDLE_MAGIC = b'TWNB'
+BUNDLE_VERSION = 1
+PRICE_SCALE = 100  # 價格以整數 (分) 儲存
+
 
 def parse_xlsx(path):
     with zipfile.ZipFile(path) as z:
@@ -44,6 +61,138 @@ def parse_xlsx(path):
     return data
 
 
+def detect_kind(path):
+    """依檔名判斷是創新高 (high) 或創新低 (low) 的比較結果"""
+    name = os.path.basename(path)
+    for kind, keyword in KIND_KEYWORDS.items():
+        if keyword in name:
+            return kind
+    return None
+
+
+def dump_compact(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def write_shards(data, kind, shard_root, source_name):
+    """將比較結果依日期與股票代號前綴切成小檔，回傳 manifest 條目
+
+    網頁只需先讀取 manifest，再依篩選條件載入對應的分片，初始載入量
+    不會隨比較期間拉長而增加。
+    """
+    by_date = defaultdict(list)
+    by_prefix = defaultdict(list)
+    stocks = {}
+    for item in data:
+        code = item.get('code', '')
+        by_date[item.get('date', '')].append(item)
+        by_prefix[code[:PREFIX_LEN]].append(item)
+        stocks[code] = item.get('name', '')
+
+    kind_dir = os.path.join(shard_root, kind)
+    if os.path.exists(kind_dir):
+        shutil.rmtree(kind_dir)  # 清除上次輸出的舊分片
+    os.makedirs(os.path.join(kind_dir, 'date'))
+    os.makedirs(os.path.join(kind_dir, 'prefix'))
+
+    for day, rows in by_date.items():
+        dump_compact(rows, os.path.join(kind_dir, 'date', f'{day}.json'))
+    for prefix, rows in by_prefix.items():
+        dump_compact(rows, os.path.join(kind_dir, 'prefix', f'{prefix}.json'))
+
+    return {
+        'source': source_name,
+        'count': len(data),
+        'dates': {day: len(rows) for day, rows in sorted(by_date.items())},
+        'prefixes': {prefix: len(rows) for prefix, rows in sorted(by_prefix.items())},
+        'stocks': dict(sorted(stocks.items())),
+    }
+
+
+def write_manifest(entries, shard_root):
+    """寫入分片索引；先寫暫存檔再取代，網頁不會讀到寫一半的 manifest"""
+    manifest = {'version': 1, 'prefix_len': PREFIX_LEN}
+    manifest.update(entries)
+    path = os.path.join(shard_root, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    dump_compact(manifest, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _to_cents(value):
+    try:
+        return int(round(float(value) * PRICE_SCALE))
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_bundle(converted):
+    """將創新高/低比較結果打包為欄式二進位格式，回傳未壓縮的 bytes
+
+    格式 (little-endian)：
+        b'TWNB' + uint32 header 長度 + header JSON (UTF-8，補空白至 4 bytes 對齊)
+        接著依 header['sets'] 順序，每個資料集依序為 5 個長度為 count 的欄位：
+        code 索引 (uint32)、date 索引 (uint32)、收盤價、基準價、新高/新低價
+        (int32，單位為 1/PRICE_SCALE 元)。
+    """
+    codes, names, dates = [], [], []
+    code_index, date_index = {}, {}
+    sets, columns = [], []
+    for kind in KIND_KEYWORDS:
+        if kind not in converted:
+            continue
+        json_path, data = converted[kind]
+        code_col, date_col = array('I'), array('I')
+        close_col, base_col, price_col = array('i'), array('i'), array('i')
+        for item in data:
+            code = item.get('code', '')
+            if code not in code_index:
+                code_index[code] = len(codes)
+                codes.append(code)
+                names.append(item.get('name', ''))
+            day = item.get('date', '')
+            if day not in date_index:
+                date_index[day] = len(dates)
+                dates.append(day)
+            code_col.append(code_index[code])
+            date_col.append(date_index[day])
+            close_col.append(_to_cents(item.get('close')))
+            base_col.append(_to_cents(item.get(f'base_{kind}')))
+            price_col.append(_to_cents(item.get(f'new_{kind}')))
+        sets.append({'kind': kind, 'count': len(data), 'source': os.path.basename(json_path)})
+        columns.extend([code_col, date_col, close_col, base_col, price_col])
+
+    header = json.dumps({
+        'version': BUNDLE_VERSION,
+        'price_scale': PRICE_SCALE,
+        'sets': sets,
+        'codes': codes,
+        'names': names,
+        'dates': dates,
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+
+    parts = [BUNDLE_MAGIC, struct.pack('<I', len(header)), header]
+    for col in columns:
+        if sys.byteorder != 'little':
+            col.byteswap()
+        parts.append(col.tobytes())
+    return b''.join(parts)
+
+
+def write_bundle(converted, path):
+    """輸出 gzip 壓縮的二進位資料包 (mtime 固定為 0，內容不變時檔案也不變)"""
+    payload = build_bundle(converted)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as f:
+            f.write(payload)
+    os.replace(tmp_path, path)
+    return path
+
+
 def batch_convert():
     """批次轉換 output 資料夾中包含'比較'的 Excel 檔案為 JSON"""
     # 取得當前腳本的目錄
@@ -75,8 +224,9 @@ def batch_convert():
     
     success_count = 0
     error_count = 0
+    converted = {}
     
-    for xlsx_path in xlsx_files:
+    for xlsx_path in sorted(xlsx_files):
         try:
             # 建立對應的 JSON 檔案路徑
             json_path = xlsx_path.replace('.xlsx', '.json')
@@ -91,6 +241,10 @@ def batch_convert():
             
             print(f'[OK] 成功轉換: {os.path.basename(json_path)}')
             success_count += 1
+            kind = detect_kind(xlsx_path)
+            if kind:
+                # 同類型有多個檔案時以檔名排序最後 (期間最新) 的為準
+                converted[kind] = (json_path, data)
             
         except FileNotFoundError as e:
             print(f'[ERROR] 檔案未找到 {os.path.basename(xlsx_path)}: {str(e)}')
@@ -102,6 +256,25 @@ def batch_convert():
             print(f'[ERROR] 轉換失敗 {os.path.basename(xlsx_path)}: {str(e)}')
             error_count += 1
     
+    if converted:
+        shard_root = os.path.join(output_dir, SHARD_DIR_NAME)
+        try:
+            entries = {
+                kind: write_shards(data, kind, shard_root, os.path.basename(json_path))
+                for kind, (json_path, data) in converted.items()
+            }
+            manifest_path = write_manifest(entries, shard_root)
+            print(f'[OK] 已輸出網頁分片資料: {os.path.relpath(manifest_path, output_dir)}')
+        except Exception as e:
+            print(f'[ERROR] 分片資料輸出失敗: {str(e)}')
+            error_count += 1
+        try:
+            bundle_path = write_bundle(converted, os.path.join(output_dir, BUNDLE_NAME))
+            print(f'[OK] 已輸出離線版資料包: {os.path.basename(bundle_path)}')
+        except Exception as e:
+            print(f'[ERROR] 離線版資料包輸出失敗: {str(e)}')
+            error_count += 1
+    
     print(f'批次轉換完成! 成功: {success_count}, 失敗: {error_count}')
     
     # 如果有錯誤，返回非零退出碼
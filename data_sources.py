@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""Pluggable data sources for the exchange download path.
+
+分析程式透過 ``DataSource.get(url)`` 取得原始回應內容，而不是直接呼叫
+``requests``，因此可以在不連線交易所的情況下測試下載流程與量測效能。
+
+來源規格 (``--source`` 參數或 ``STOCK_DATA_SOURCE`` 環境變數)：
+
+    http                          直接連線 TWSE / TPEx (預設)
+    http://127.0.0.1:8765         把請求改送到本機重播伺服器，保留路徑與查詢字串
+    fixture[:選項]                 程序內直接由快取產生回應，不經過網路
+
+fixture 與重播伺服器共用相同的選項 (以逗號分隔)：
+    latency=秒      每次請求的固定延遲
+    jitter=秒       額外的隨機延遲上限
+    error_rate=比例  回應 HTTP 500 的機率
+    throttle_rate=比例 回應 HTTP 429 (附 Retry-After) 的機率
+    seed=整數        固定亂數種子，讓錯誤注入可重現
+    data=目錄        錄製資料所在目錄 (內含 cache_high/cache_low，預設 output)
+
+回應內容由 ``cache_high`` 與 ``cache_low`` 的快取重建：
+TWSE MI_INDEX 以 CP950 CSV 回傳 (欄位位置與真實檔案相同)；TPEx 的每日
+收盤與交易日 API 以 JSON 回傳 (上櫃沒有快取，以上市資料代替，只用於測試
+下載流程)。沒有快取的日期視為休市，回傳空內容。
+
+啟動重播伺服器::
+
+    python data_sources.py --port 8765 --latency 0.05 --throttle-rate 0.1
+"""
+
+import abc
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import requests
+
+from cache_io import InvalidCacheError, load_json_records
+
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+CACHE_SUBDIRS = {'high': 'cache_high', 'low': 'cache_low'}
+DEFAULT_TIMEOUT = 10
+DEFAULT_PORT = 8765
+
+TWSE_DAILY_PATH = '/exchangeReport/MI_INDEX'
+TPEX_DAILY_PATH = '/openapi/v1/tpex_mainboard_daily_close_quotes'
+TPEX_TRADING_DAYS_PATH = '/openapi/v1/exchange/suspension_trading_days'
+# 交易所尚未公布資料時回應的說明文字
+NOT_PUBLISHED_NOTICE = '很抱歉，沒有符合條件的資料!'
+
+
+class DataSourceError(Exception):
+    """下載失敗；``status`` 為 HTTP 狀態碼 (連線錯誤時為 None)"""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class SourceStats:
+    """記錄請求數、錯誤數與耗時，供量測下載吞吐量"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.seconds += elapsed
+            if not ok:
+                self.errors += 1
+
+    def summary(self) -> str:
+        wall = time.perf_counter() - self.started
+        avg = self.seconds / self.requests * 1000 if self.requests else 0.0
+        rate = self.requests / wall if wall else 0.0
+        return (f'{self.requests} requests, {self.errors} errors, '
+                f'avg {avg:.1f} ms, {rate:.1f} req/s')
+
+
+class DataSource(abc.ABC):
+    """資料來源介面：依網址回傳原始 bytes，失敗時丟出 DataSourceError"""
+
+    name = 'base'
+
+    def __init__(self) -> None:
+        self.stats = SourceStats()
+
+    def get(self, url: str, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+        started = time.perf_counter()
+        ok = False
+        try:
+            content = self._get(url, timeout)
+            ok = True
+            return content
+        finally:
+            self.stats.record(time.perf_counter() - started, ok)
+
+    @abc.abstractmethod
+    def _get(self, url: str, timeout: float) -> bytes:
+        """子類別實作實際的下載"""
+
+
+class HttpSource(DataSource):
+    """以 requests 下載；指定 base_url 時改送到該主機 (例如本機重播伺服器)"""
+
+    name = 'http'
+
+    def __init__(self, base_url: Optional[str] = None) -> None:
+        super().__init__()
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.session = requests.Session()
+
+    def rewrite(self, url: str) -> str:
+        if not self.base_url:
+            return url
+        target = urlsplit(self.base_url)
+        parts = urlsplit(url)
+        return urlunsplit((target.scheme, target.netloc,
+                           target.path + parts.path, parts.query, ''))
+
+    def _get(self, url: str, timeout: float) -> bytes:
+        try:
+            resp = self.session.get(self.rewrite(url), timeout=timeout)
+        except requests.RequestException as exc:
+            raise DataSourceError(str(exc)) from exc
+        if resp.status_code >= 400:
+            raise DataSourceError(
+                f'HTTP {resp.status_code} for {url}',
+                status=resp.status_code,
+                retry_after=_parse_retry_after(resp.headers.get('Retry-After')),
+            )
+        return resp.content
+
+
+class Fixture:
+    """由快取重建交易所回應，並依設定注入延遲與錯誤"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 seed: Optional[int] = None, data: str = OUTPUT_DIR) -> None:
+        self.cache_dirs = {kind: os.path.join(data, sub) for kind, sub in CACHE_SUBDIRS.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self._days: Dict[str, List[Dict[str, Any]]] = {}
+
+    def respond(self, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        """回傳 (HTTP 狀態碼, headers, 內容)"""
+        with self.lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            return 429, {'Retry-After': '1'}, b'Too Many Requests'
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}, b'Injected error'
+
+        parts = urlsplit(url)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if parts.path == TWSE_DAILY_PATH:
+            return 200, {'Content-Type': 'text/csv; charset=cp950'}, \
+                self.twse_csv(query.get('date', ''))
+        if parts.path == TPEX_DAILY_PATH:
+            return 200, {'Content-Type': 'application/json'}, \
+                self.tpex_daily(query.get('d', ''))
+        if parts.path == TPEX_TRADING_DAYS_PATH:
+            return 200, {'Content-Type': 'application/json'}, self.tpex_trading_days()
+        return 404, {}, b'Not Found'
+
+    def day(self, date: str) -> List[Dict[str, Any]]:
+        """合併 high/low 快取為 ``{code, name, high, low, close}`` 清單"""
+        with self.lock:
+            if date in self._days:
+                return self._days[date]
+        merged: Dict[str, Dict[str, Any]] = {}
+        for kind, cache_dir in self.cache_dirs.items():
+            try:
+                records = load_json_records(os.path.join(cache_dir, f'{date}.json')) or []
+            except InvalidCacheError:
+                records = []
+            for rec in records:
+                row = merged.setdefault(rec['code'], {'code': rec['code'], 'name': rec['name']})
+                row[kind] = rec.get(kind)
+                row['close'] = rec.get('close')
+        rows = sorted(merged.values(), key=lambda r: r['code'])
+        with self.lock:
+            self._days[date] = rows
+        return rows
+
+    def cached_dates(self) -> List[str]:
+        dates = set()
+        for cache_dir in self.cache_dirs.values():
+            if os.path.isdir(cache_dir):
+                dates.update(name[:-5] for name in os.listdir(cache_dir)
+                             if name.endswith('.json') and name[:-5].isdigit())
+        return sorted(dates)
+
+    def twse_csv(self, date: str) -> bytes:
+        rows = self.day(date)
+        if not rows:
+            cached = self.cached_dates()
+            if cached and date > cached[-1]:
+                # 錄製資料之後的日期視為交易所尚未公布，回傳非 CSV 的說明
+                return NOT_PUBLISHED_NOTICE.encode('cp950')
+            return b''  # 與 TWSE 休市日相同，回傳空內容
+        lines = [f'"{date[:4]}年{date[4:6]}月{date[6:]}日 每日收盤行情(全部)"',
+                 '"證券代號","證券名稱","成交股數","成交筆數","成交金額","開盤價","最高價",'
+                 '"最低價","收盤價","漲跌(+/-)","漲跌價差","最後揭示買價","最後揭示買量",'
+                 '"最後揭示賣價","最後揭示賣量","本益比"']
+        for row in rows:
+            close = _fmt(row.get('close'))
+            fields = [row['code'], row['name'], '0', '0', '0', close,
+                      _fmt(row.get('high')), _fmt(row.get('low')), close,
+                      '', '0.00', close, '0', close, '0', '0.00']
+            lines.append(','.join(f'"{field}"' for field in fields))
+        lines.append('"備註:"')
+        return ('\r\n'.join(lines) + '\r\n').encode('cp950', errors='replace')
+
+    def tpex_daily(self, roc_date: str) -> bytes:
+        try:
+            year, month, day = (int(part) for part in roc_date.split('/'))
+            date = f'{year + 1911:04d}{month:02d}{day:02d}'
+        except ValueError:
+            return b'[]'
+        data = [
+            {'Code': row['code'], 'Name': row['name'],
+             'Low': _fmt(row.get('low')), 'Close': _fmt(row.get('close'))}
+            for row in self.day(date) if len(row['code']) == 4
+        ]
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def tpex_trading_days(self) -> bytes:
+        data = []
+        for date in self.cached_dates():
+            dt = datetime.strptime(date, '%Y%m%d')
+            data.append({'Date': f'{dt.year - 1911}/{dt.month:02d}/{dt.day:02d}',
+                         'TradingType': '0'})
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class FixtureSource(DataSource):
+    """程序內直接使用 Fixture 回應，不經過網路"""
+
+    name = 'fixture'
+
+    def __init__(self, fixture: Fixture) -> None:
+        super().__init__()
+        self.fixture = fixture
+
+    def _get(self, url: str, timeout: float) -> bytes:
+        status, headers, body = self.fixture.respond(url)
+        if status >= 400:
+            raise DataSourceError(
+                f'HTTP {status} for {url}', status=status,
+                retry_after=_parse_retry_after(headers.get('Retry-After')),
+            )
+        return body
+
+
+def _fmt(value: Optional[float]) -> str:
+    return '--' if value is None else f'{value:,.2f}'
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_fixture_options(text: str) -> Dict[str, Any]:
+    options: Dict[str, Any] = {}
+    for item in filter(None, text.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key == 'seed':
+            options['seed'] = int(value)
+        elif key == 'data':
+            options['data'] = value
+        elif key in ('latency', 'jitter', 'error_rate', 'throttle_rate'):
+            options[key] = float(value)
+        else:
+            raise ValueError(f'Unknown fixture option {key!r}')
+    return options
+
+
+def create_source(spec: Optional[str] = None) -> DataSource:
+    """依規格字串建立資料來源，未指定時讀取 STOCK_DATA_SOURCE 環境變數"""
+    spec = spec or os.environ.get('STOCK_DATA_SOURCE') or 'http'
+    if spec == 'http':
+        return HttpSource()
+    if spec.startswith(('http://', 'https://')):
+        return HttpSource(base_url=spec)
+    name, _, options = spec.partition(':')
+    if name == 'fixture':
+        return FixtureSource(Fixture(**parse_fixture_options(options)))
+    raise ValueError(f'Unknown data source {spec!r}')
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    fixture: Fixture
+    stats: SourceStats
+
+    def do_GET(self) -> None:
+        started = time.perf_counter()
+        status, headers, body = self.fixture.respond(self.path)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.stats.record(time.perf_counter() - started, status < 400)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+def serve(fixture: Fixture, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+          report_every: float = 10.0) -> None:
+    """啟動多執行緒重播伺服器，定期輸出請求統計，Ctrl+C 結束"""
+    stats = SourceStats()
+    handler = type('Handler', (ReplayRequestHandler,), {'fixture': fixture, 'stats': stats})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info('Replay server listening on http://%s:%d', host, server.server_port)
+    try:
+        while thread.is_alive():
+            time.sleep(report_every)
+            logging.info('Replay stats: %s', stats.summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        logging.info('Replay server stopped: %s', stats.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='以既有快取重播交易所資料的本機伺服器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help='每次請求的固定延遲 (秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='額外的隨機延遲上限 (秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='回應 HTTP 500 的機率')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='回應 HTTP 429 的機率')
+    parser.add_argument('--seed', type=int, default=None, help='固定亂數種子')
+    parser.add_argument('--data-dir', default=OUTPUT_DIR,
+                        help='錄製資料目錄，內含 cache_high/cache_low (預設 %(default)s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    fixture = Fixture(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      throttle_rate=args.throttle_rate, seed=args.seed, data=args.data_dir)
+    serve(fixture, args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""Intraday monitor that flags stocks crossing their base-period high or low.
+
+收盤後的分析程式以 ``record_highest_prices``/``record_lowest_prices`` 算出
+基準期間的高低點；本程式在盤中預先把這些門檻載入成緊湊的陣列，接著逐批
+讀取報價快照，每筆報價只做一次 dict 查找與兩次比較 (O(1))，一旦突破即輸出
+創新高/創新低事件。突破後門檻會更新為新的極值，同一檔股票只有再創新高/低
+時才會再次觸發。
+
+報價來源可抽換 (``FEEDS``)：
+    file:PATH          重播 JSON Lines 檔案 (每行一批快照)
+    socket:HOST:PORT   從 TCP socket 讀取相同格式的 JSON Lines
+
+每行格式：``{"time": "09:00:05", "quotes": [["2330", 1005.0], ...]}``，
+quotes 也可以是 ``{"code": "2330", "price": 1005.0}`` 的清單。
+``--make-replay`` 可由既有快取產生模擬的盤中重播檔。
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import time
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import tse_stock_price_analyzer_high as high_analyzer
+import tse_stock_price_analyzer_low as low_analyzer
+from price_store import PriceStore
+
+OUTPUT_DIR = high_analyzer.OUTPUT_DIR
+LOG_FILE = os.path.join(OUTPUT_DIR, 'intraday_breakout_monitor.log')
+SUMMARY_EVERY = 1000  # 每處理幾批快照輸出一次延遲統計
+
+Quote = Tuple[str, float]
+Batch = Tuple[str, List[Quote]]
+
+
+def setup_logging() -> None:
+    """Configure logging to file and console."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE, encoding='utf-8'),
+            logging.StreamHandler(),
+        ],
+    )
+
+
+class ThresholdTable:
+    """每檔股票的基準高低點，以 array('d') 儲存，以代號對應索引"""
+
+    def __init__(self, highest: Dict[str, Dict[str, Any]],
+                 lowest: Dict[str, Dict[str, Any]]) -> None:
+        codes = sorted(set(highest) | set(lowest))
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(codes)}
+        self.codes = codes
+        self.names = [
+            (highest.get(code) or lowest.get(code))['name'] for code in codes
+        ]
+        # 缺少某一邊的基準價時以 ±inf 表示，永遠不會觸發
+        self.base_high = array('d', (
+            highest[code]['high'] if code in highest else math.inf for code in codes
+        ))
+        self.base_low = array('d', (
+            lowest[code]['low'] if code in lowest else -math.inf for code in codes
+        ))
+        self.high = array('d', self.base_high)
+        self.low = array('d', self.base_low)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+def load_thresholds(base_dates: List[str], db_path: Optional[str] = None) -> ThresholdTable:
+    """由快取 (或 SQLite 資料庫) 計算基準期間的高低點"""
+    if db_path:
+        with PriceStore(db_path) as store:
+            highest = store.base_extremes('high', base_dates[0], base_dates[-1])
+            lowest = store.base_extremes('low', base_dates[0], base_dates[-1])
+    else:
+        high_records = {d: high_analyzer.load_cache_data(d) for d in base_dates}
+        low_records = {d: low_analyzer.load_cache_data(d) for d in base_dates}
+        highest = high_analyzer.record_highest_prices(high_records, base_dates)
+        lowest = low_analyzer.record_lowest_prices(low_records, base_dates)
+    table = ThresholdTable(highest, lowest)
+    logging.info('Loaded thresholds for %d stocks (%s-%s)',
+                 len(table), base_dates[0], base_dates[-1])
+    return table
+
+
+class BreakoutMonitor:
+    """逐批檢查報價是否突破門檻，並統計每批處理延遲"""
+
+    def __init__(self, table: ThresholdTable,
+                 on_event: Callable[[Dict[str, Any]], None]) -> None:
+        self.table = table
+        self.on_event = on_event
+        self.batches = 0
+        self.ticks = 0
+        self.events = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def process(self, stamp: str, quotes: List[Quote]) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        table = self.table
+        index_get = table.index.get
+        high, low = table.high, table.low
+        hits: List[Tuple[str, int, float, float]] = []
+        for code, price in quotes:
+            i = index_get(code)
+            if i is None:
+                continue
+            if price > high[i]:
+                hits.append(('high', i, price, high[i]))
+                high[i] = price
+            elif price < low[i]:
+                hits.append(('low', i, price, low[i]))
+                low[i] = price
+        elapsed = time.perf_counter() - started
+
+        self.batches += 1
+        self.ticks += len(quotes)
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+        # 事件物件在計時區段外才建立，避免影響每批延遲
+        events = []
+        for kind, i, price, previous in hits:
+            base = table.base_high[i] if kind == 'high' else table.base_low[i]
+            event = {
+                'time': stamp,
+                'kind': kind,
+                'code': table.codes[i],
+                'name': table.names[i],
+                'price': price,
+                'base': base,
+                'previous': previous,
+            }
+            events.append(event)
+            self.on_event(event)
+        self.events += len(events)
+        if self.batches % SUMMARY_EVERY == 0:
+            self.log_summary()
+        return events
+
+    def log_summary(self) -> None:
+        if not self.batches:
+            return
+        logging.info(
+            'Processed %d batches / %d ticks, %d events, latency avg %.1f us max %.1f us',
+            self.batches, self.ticks, self.events,
+            self.total_seconds / self.batches * 1e6, self.max_seconds * 1e6,
+        )
+
+
+def _parse_line(line: str) -> Optional[Batch]:
+    line = line.strip()
+    if not line:
+        return None
+    snapshot = json.loads(line)
+    quotes: List[Quote] = []
+    for quote in snapshot.get('quotes', []):
+        if isinstance(quote, dict):
+            quotes.append((str(quote['code']), float(quote['price'])))
+        else:
+            quotes.append((str(quote[0]), float(quote[1])))
+    return str(snapshot.get('time', '')), quotes
+
+
+def _parse_lines(lines: Iterable[str], source: str) -> Iterator[Batch]:
+    """逐行解析快照；格式錯誤的行記錄警告後略過，不中斷監控"""
+    skipped = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            batch = _parse_line(line)
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            skipped += 1
+            logging.warning('Skipped malformed snapshot %s line %d (%d skipped so far): %s',
+                            source, number, skipped, e)
+            continue
+        if batch is not None:
+            yield batch
+
+
+def file_feed(path: str, interval: float = 0.0) -> Iterator[Batch]:
+    """重播 JSON Lines 檔案；interval > 0 時每批之間暫停，模擬實際推送速度"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for batch in _parse_lines(f, path):
+            yield batch
+            if interval:
+                time.sleep(interval)
+
+
+def socket_feed(address: str, interval: float = 0.0) -> Iterator[Batch]:
+    """從 ``HOST:PORT`` 讀取 JSON Lines 快照，連線關閉時結束"""
+    host, port = address.rsplit(':', 1)
+    with socket.create_connection((host, int(port))) as conn:
+        with conn.makefile('r', encoding='utf-8') as stream:
+            yield from _parse_lines(stream, address)
+
+
+FEEDS: Dict[str, Callable[[str, float], Iterable[Batch]]] = {
+    'file': file_feed,
+    'socket': socket_feed,
+}
+
+
+def open_feed(spec: str, interval: float = 0.0) -> Iterable[Batch]:
+    """依 ``名稱:參數`` 建立報價來源，例如 ``file:output/replay.jsonl``"""
+    name, _, target = spec.partition(':')
+    if name not in FEEDS or not target:
+        raise ValueError(f'Unknown feed {spec!r}; expected one of '
+                         + ', '.join(f'{n}:...' for n in FEEDS))
+    return FEEDS[name](target, interval)
+
+
+def make_replay(date: str, path: str, steps: int = 60) -> int:
+    """由快取產生模擬盤中重播檔，回傳寫入的快照數
+
+    每檔股票的價格由前一日收盤出發，依序走到當日最高、最低，最後收在當日收盤，
+    因此實際發生過的盤中突破都會在重播中出現。
+    """
+    highs = {r['code']: r for r in high_analyzer.load_cache_data(date)}
+    lows = {r['code']: r for r in low_analyzer.load_cache_data(date)}
+    if not highs or not lows:
+        raise ValueError(f'No cached high/low data for {date}')
+    previous = {}
+    for day in sorted(d for d in high_analyzer.ALL_DATES if d < date):
+        previous.update({r['code']: r['close'] for r in high_analyzer.load_cache_data(day)})
+
+    codes = sorted(set(highs) & set(lows))
+    legs = max(steps // 3, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        for step in range(legs * 3 + 1):
+            leg, pos = divmod(step, legs)
+            frac = pos / legs
+            quotes = []
+            for code in codes:
+                close = highs[code]['close']
+                path_points = (previous.get(code, close), highs[code]['high'],
+                               lows[code]['low'], close, close)
+                start, end = path_points[leg], path_points[leg + 1]
+                quotes.append([code, round(start + (end - start) * frac, 2)])
+            minutes = 9 * 60 + step * 270 // (legs * 3)
+            stamp = f'{minutes // 60:02d}:{minutes % 60:02d}:00'
+            f.write(json.dumps({'time': stamp, 'quotes': quotes}) + '\n')
+    logging.info('Wrote %d snapshots for %d stocks to %s', legs * 3 + 1, len(codes), path)
+    return legs * 3 + 1
+
+
+def print_event(event: Dict[str, Any]) -> None:
+    label = '創新高' if event['kind'] == 'high' else '創新低'
+    base_label = '基準高點' if event['kind'] == 'high' else '基準低點'
+    print(f"{event['code']},{event['name']},{event['time']}{label},"
+          f"價格{event['price']:.2f},({base_label}:{event['base']:.2f})")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='盤中監控股票是否突破基準期間高低點')
+    parser.add_argument('--feed', default=None,
+                        help='報價來源，例如 file:output/replay.jsonl 或 socket:127.0.0.1:9000')
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help='重播檔每批之間暫停秒數 (預設 0，全速重播)')
+    parser.add_argument('--base-start', default=high_analyzer.BASE_DATES[0])
+    parser.add_argument('--base-end', default=high_analyzer.BASE_DATES[-1])
+    parser.add_argument('--db', default=None, metavar='PATH',
+                        help='改由 SQLite 資料庫計算基準高低點')
+    parser.add_argument('--events', default=None, metavar='PATH',
+                        help='另將事件以 JSON Lines 追加寫入此檔案')
+    parser.add_argument('--make-replay', default=None, metavar='YYYYMMDD',
+                        help='由快取產生指定日期的模擬重播檔後結束 (輸出至 --feed 的 file 路徑)')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    setup_logging()
+
+    if args.make_replay:
+        name, _, target = (args.feed or '').partition(':')
+        if name != 'file' or not target:
+            raise SystemExit('--make-replay 需要搭配 --feed file:PATH 指定輸出檔')
+        make_replay(args.make_replay, target)
+        return
+    if not args.feed:
+        raise SystemExit('請以 --feed 指定報價來源')
+
+    base_dates = high_analyzer.generate_dates(args.base_start, args.base_end)
+    table = load_thresholds(base_dates, args.db)
+
+    events_file = open(args.events, 'a', encoding='utf-8') if args.events else None
+
+    def on_event(event: Dict[str, Any]) -> None:
+        print_event(event)
+        if events_file is not None:
+            events_file.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    monitor = BreakoutMonitor(table, on_event)
+    try:
+        for stamp, quotes in open_feed(args.feed, args.interval):
+            monitor.process(stamp, quotes)
+    except KeyboardInterrupt:
+        logging.info('Monitor stopped by user')
+    finally:
+        if events_file is not None:
+            events_file.close()
+        monitor.log_summary()
+
+
+if __name__ == '__main__':
+    main()
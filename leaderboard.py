@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Per-date top-K leaderboard of the strongest new-high / new-low breakouts.
+
+比較結果原本是未排序的清單，要找出當天最強的個股必須排序全部事件。
+``Leaderboard`` 在比較階段產生事件的同時，以每個日期一個大小固定為 K
+的 min-heap 保留強度最高的事件 (每筆 O(log K))，最後輸出成小型 JSON：
+
+    strength_pct  超越基準高點 (或跌破基準低點) 的幅度 %
+    distance_pct  超越前一次極值的幅度 %；首次突破時前一次極值即為基準。
+                  創新低是以基準低點判斷，若當天仍高於比較期間先前的低點則為負值
+
+排序以 ``strength_pct`` 為主、``distance_pct`` 為次。
+"""
+
+import heapq
+import os
+from typing import Any, Dict, List, Tuple
+
+from cache_io import atomic_write_json
+
+KINDS = ('high', 'low')
+DEFAULT_TOP_K = 50
+
+_Entry = Tuple[float, float, str, Dict[str, Any], float]
+
+
+def beyond_pct(kind: str, price: float, reference: float) -> float:
+    """價格超越參考價的百分比 (創新低時為跌破的幅度)"""
+    if not reference:
+        return 0.0
+    if kind == 'high':
+        return (price - reference) / reference * 100
+    return (reference - price) / reference * 100
+
+
+class Leaderboard:
+    """每個日期保留前 K 強的突破事件"""
+
+    def __init__(self, kind: str, k: int = DEFAULT_TOP_K) -> None:
+        if kind not in KINDS:
+            raise ValueError(f'kind must be one of {KINDS}, got {kind!r}')
+        if k < 1:
+            raise ValueError(f'k must be positive, got {k}')
+        self.kind = kind
+        self.k = k
+        self._heaps: Dict[str, List[_Entry]] = {}
+        self.events = 0
+
+    def push(self, event: Dict[str, Any], previous: float) -> None:
+        """加入一筆比較結果；``previous`` 為突破前的極值 (首次突破時等於基準價)"""
+        kind = self.kind
+        price = event[kind]
+        strength = beyond_pct(kind, price, event[f'base_{kind}'])
+        distance = beyond_pct(kind, price, previous)
+        self.events += 1
+        heap = self._heaps.setdefault(event['date'], [])
+        # 同一天同一檔股票只有一筆事件，代號可作為同分時的比較鍵，避免比較 dict
+        entry = (strength, distance, event['code'], event, previous)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, entry)
+
+    def dates(self) -> List[str]:
+        return sorted(self._heaps)
+
+    def top(self, date: str) -> List[Dict[str, Any]]:
+        """回傳指定日期由強到弱的排行"""
+        kind = self.kind
+        entries = sorted(self._heaps.get(date, []), key=lambda e: e[:3], reverse=True)
+        ranked = []
+        for rank, (strength, distance, code, event, previous) in enumerate(entries, 1):
+            ranked.append({
+                'rank': rank,
+                'code': code,
+                'name': event['name'],
+                'close': event['close'],
+                f'base_{kind}': event[f'base_{kind}'],
+                f'new_{kind}': event[kind],
+                'previous': previous,
+                'strength_pct': round(strength, 2),
+                'distance_pct': round(distance, 2),
+            })
+        return ranked
+
+    def to_dict(self) -> Dict[str, Any]:
+        dates = self.dates()
+        return {
+            'kind': self.kind,
+            'k': self.k,
+            'latest': dates[-1] if dates else None,
+            'dates': {date: self.top(date) for date in dates},
+        }
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        atomic_write_json(path, self.to_dict())
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Non-blocking structured logging for long backfills and analysis runs.
+
+預設的 ``logging.basicConfig`` 在呼叫端同步寫入檔案與主控台，且
+``fetch_records``/``load_cache_data``/``save_cache_data`` 等函式每個日期都會
+輸出數行 INFO，多年期間的執行時 log 成本明顯且檔案不會輪替。
+``setup_queue_logging`` 改為：
+
+* 呼叫端只把記錄放進 ``queue`` (``QueueHandler``)，由背景執行緒的
+  ``QueueListener`` 負責格式化與寫入。
+* 檔案輸出為 JSON Lines，並以 ``RotatingFileHandler`` 限制大小與份數。
+* ``ProgressSummaryFilter`` 在放入 queue 之前就攔下每個日期的 INFO 訊息，
+  只累計次數，定期輸出一行進度摘要；WARNING 以上的訊息不受影響。
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+# 每個日期都會輸出的 INFO 訊息來源 (函式名稱)
+CHATTY_FUNCTIONS = (
+    'fetch_records',
+    'load_cache_data',
+    'save_cache_data',
+    'fetch_csv',
+    'save_downloaded_date',
+    'run_backfill',
+)
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_SUMMARY_INTERVAL = 5.0
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆記錄輸出為一行精簡 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'func': record.funcName,
+            'msg': record.getMessage(),
+        }
+        if record.name != 'root':
+            entry['logger'] = record.name
+        summary = getattr(record, 'summary', None)
+        if summary is not None:
+            entry['summary'] = summary
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+def _record_date(record: logging.LogRecord) -> Optional[str]:
+    """取出訊息參數中的 YYYYMMDD 日期 (找不到時回傳 None)"""
+    args = record.args if isinstance(record.args, tuple) else ()
+    for arg in args:
+        if isinstance(arg, str) and len(arg) == 8 and arg.isdigit():
+            return arg
+    return None
+
+
+class ProgressSummaryFilter(logging.Filter):
+    """把逐日的 INFO 訊息彙整成定期的進度摘要
+
+    被彙整的記錄不會放入 queue；達到 ``interval`` 秒時，當下這筆記錄會被
+    改寫成摘要後放行 (摘要內容另存於 ``record.summary`` 供 JSON 輸出)。
+    """
+
+    def __init__(self, functions: Iterable[str] = CHATTY_FUNCTIONS,
+                 interval: float = DEFAULT_SUMMARY_INTERVAL) -> None:
+        super().__init__()
+        self.functions = frozenset(functions)
+        self.interval = interval
+        self.counts: Dict[str, int] = {}
+        self.dates = set()
+        self.last_date: Optional[str] = None
+        self.last_emit = time.monotonic()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.INFO or record.funcName not in self.functions:
+            return True
+        self.counts[record.funcName] = self.counts.get(record.funcName, 0) + 1
+        date = _record_date(record)
+        if date:
+            self.dates.add(date)
+            self.last_date = date
+        if time.monotonic() - self.last_emit < self.interval:
+            return False
+        self._rewrite(record)
+        return True
+
+    def pending(self) -> bool:
+        return bool(self.counts)
+
+    def _rewrite(self, record: logging.LogRecord) -> None:
+        summary = {
+            'dates': len(self.dates),
+            'last_date': self.last_date,
+            'messages': dict(self.counts),
+        }
+        record.msg = 'Progress: %d dates (last %s), %s'
+        record.args = (
+            summary['dates'], summary['last_date'] or '-',
+            ', '.join(f'{name} x{count}' for name, count in sorted(self.counts.items())),
+        )
+        record.funcName = 'progress'
+        record.summary = summary
+        self.counts = {}
+        self.dates = set()
+        self.last_emit = time.monotonic()
+
+    def flush(self, logger: Optional[logging.Logger] = None) -> None:
+        """輸出尚未摘要的累計次數 (程式結束時呼叫)"""
+        if not self.pending():
+            return
+        record = (logger or logging.getLogger()).makeRecord(
+            'root', logging.INFO, __file__, 0, 'Progress', (), None, func='progress',
+        )
+        self._rewrite(record)
+        (logger or logging.getLogger()).handle(record)
+
+
+def setup_queue_logging(log_file: str, level: int = logging.INFO,
+                        max_bytes: int = DEFAULT_MAX_BYTES,
+                        backup_count: int = DEFAULT_BACKUP_COUNT,
+                        summary_interval: float = DEFAULT_SUMMARY_INTERVAL,
+                        console: bool = True) -> logging.handlers.QueueListener:
+    """以背景 queue 寫入輪替的 JSON Lines 檔 (與主控台)，回傳已啟動的 listener
+
+    程式結束時會自動輸出最後一次進度摘要並停止 listener。
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8',
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        handlers.append(stream_handler)
+
+    log_queue: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    summary_filter = ProgressSummaryFilter(interval=summary_interval)
+    queue_handler.addFilter(summary_filter)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def stop() -> None:
+        summary_filter.flush(root)
+        listener.stop()
+        for handler in handlers:
+            handler.close()
+
+    atexit.register(stop)
+    return listener
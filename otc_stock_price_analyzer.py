@@ -1,13 +1,15 @@
 import csv
 import io
+import json
 import os
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 
-import requests
 from openpyxl import Workbook
 
+import data_sources
+
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 LOG_FILE = os.path.join(OUTPUT_DIR, 'otc_stock_price_analyzer.log')
 
@@ -15,6 +17,9 @@ TRADING_DAYS_URL = 'https://www.tpex.org.tw/openapi/v1/exchange/suspension_tradi
 DAILY_URL = ('https://www.tpex.org.tw/openapi/v1/tpex_mainboard_daily_close_quotes'
              '?l=zh-tw&d={date}&s=0,asc,0')
 
+# 下載來源可用 STOCK_DATA_SOURCE 環境變數替換為本機重播伺服器或 fixture
+SOURCE = data_sources.create_source()
+
 
 def setup_logging() -> None:
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -35,9 +40,7 @@ def to_roc_date(date: str) -> str:
 
 def fetch_trading_days(start: str, end: str) -> List[str]:
     try:
-        response = requests.get(TRADING_DAYS_URL, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = json.loads(SOURCE.get(TRADING_DAYS_URL, timeout=10))
     except Exception as exc:
         logging.error('Failed to fetch trading days: %s', exc)
         return []
@@ -64,9 +67,7 @@ def fetch_records(date: str) -> List[Dict[str, Any]]:
     url = DAILY_URL.format(date=roc)
     logging.info('Start download %s', date)
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = json.loads(SOURCE.get(url, timeout=10))
     except Exception as exc:
         logging.error('Failed to download %s: %s', date, exc)
         return []
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Export price records and comparison events as typed Parquet/Arrow datasets.
+
+Excel 輸出把價格存成格式化字串，下游以 pandas 讀取時既慢又失去數值型別。
+本模組把同樣的資料寫成依月份分割 (hive 風格 ``month=YYYY-MM``) 的
+Parquet 或 Arrow IPC 資料集，日期為 ``date32``、價格為 ``float64``::
+
+    import pandas as pd
+    pd.read_parquet('output/parquet/prices_high', columns=['date', 'code', 'high'])
+
+需要安裝選用套件 ``pyarrow``。
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # 選用套件，未安裝時只停用匯出功能
+    pa = None
+    ds = None
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+FILE_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError('Parquet/Arrow 匯出需要安裝 pyarrow: pip install pyarrow')
+
+
+def _to_date(value: str):
+    return datetime.strptime(value, '%Y%m%d').date()
+
+
+def price_records_table(data: Dict[str, List[Dict[str, Any]]], kind: str) -> 'pa.Table':
+    """將 ``{date: [record, ...]}`` 轉成 Arrow 表格 (date, month, code, name, kind, close)"""
+    _require_pyarrow()
+    dates, months, codes, names, prices, closes = [], [], [], [], [], []
+    for date in sorted(data):
+        day = _to_date(date)
+        month = day.strftime('%Y-%m')
+        for rec in data[date]:
+            dates.append(day)
+            months.append(month)
+            codes.append(rec['code'])
+            names.append(rec['name'])
+            prices.append(rec[kind])
+            closes.append(rec['close'])
+    return pa.table({
+        'date': pa.array(dates, pa.date32()),
+        'month': pa.array(months, pa.string()),
+        'code': pa.array(codes, pa.string()),
+        'name': pa.array(names, pa.string()),
+        kind: pa.array(prices, pa.float64()),
+        'close': pa.array(closes, pa.float64()),
+    })
+
+
+def events_table(results: List[Dict[str, Any]], kind: str) -> 'pa.Table':
+    """將比較結果轉成 Arrow 表格 (date, month, code, name, close, base_kind, new_kind)"""
+    _require_pyarrow()
+    rows = sorted(results, key=lambda item: (item['date'], item['code']))
+    days = [_to_date(item['date']) for item in rows]
+    return pa.table({
+        'date': pa.array(days, pa.date32()),
+        'month': pa.array([day.strftime('%Y-%m') for day in days], pa.string()),
+        'code': pa.array([item['code'] for item in rows], pa.string()),
+        'name': pa.array([item['name'] for item in rows], pa.string()),
+        'close': pa.array([item['close'] for item in rows], pa.float64()),
+        f'base_{kind}': pa.array([item[f'base_{kind}'] for item in rows], pa.float64()),
+        f'new_{kind}': pa.array([item[kind] for item in rows], pa.float64()),
+    })
+
+
+def write_dataset(table: 'pa.Table', root: str, fmt: str = 'parquet') -> None:
+    """依 month 欄位分割寫入資料集；重新執行時只覆蓋本次涵蓋的月份"""
+    _require_pyarrow()
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of {sorted(FORMATS)}, got {fmt!r}')
+    os.makedirs(root, exist_ok=True)
+    ds.write_dataset(
+        table,
+        root,
+        format=FORMATS[fmt],
+        partitioning=ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive'),
+        basename_template='part-{i}.' + FILE_EXTENSIONS[fmt],
+        existing_data_behavior='delete_matching',
+    )
+
+
+def export_analysis(output_dir: str, kind: str,
+                    price_records: Dict[str, List[Dict[str, Any]]],
+                    results: List[Dict[str, Any]], fmt: str = 'parquet') -> List[str]:
+    """匯出價格歷史與比較事件兩個資料集，回傳資料集目錄"""
+    base = os.path.join(output_dir, fmt)
+    prices_root = os.path.join(base, f'prices_{kind}')
+    events_root = os.path.join(base, f'new_{kind}_events')
+    write_dataset(price_records_table(price_records, kind), prices_root, fmt)
+    write_dataset(events_table(results, kind), events_root, fmt)
+    return [prices_root, events_root]
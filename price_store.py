@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""SQLite-backed store for daily prices and new-high/new-low events.
+
+分析程式下載的每日資料除了寫入 ``output/cache_*`` 之外，也可以選擇寫入
+同一個 SQLite 資料庫 (WAL 模式)，讓分析人員直接以 SQL 或下列查詢 API
+進行臨時查詢，不需要把所有 JSON 載入 Python。
+
+資料表：
+    prices(date, code, name, high, low, close)  -- 主鍵 (date, code)
+    events(kind, date, code, name, close, base, price)  -- kind 為 'high' 或 'low'
+
+日期一律使用 ``YYYYMMDD`` 字串，與快取檔名相同。
+"""
+
+import os
+import sqlite3
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    date  TEXT NOT NULL,
+    code  TEXT NOT NULL,
+    name  TEXT,
+    high  REAL,
+    low   REAL,
+    close REAL,
+    PRIMARY KEY (date, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_prices_code_date ON prices (code, date);
+
+CREATE TABLE IF NOT EXISTS events (
+    kind  TEXT NOT NULL,
+    date  TEXT NOT NULL,
+    code  TEXT NOT NULL,
+    name  TEXT,
+    close REAL,
+    base  REAL,
+    price REAL,
+    PRIMARY KEY (kind, date, code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_events_code_date ON events (code, date);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events (date);
+"""
+
+KINDS = ('high', 'low')
+
+
+class PriceStore:
+    """Thin wrapper around a SQLite connection holding prices and events."""
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # timeout 讓多個分析程式同時寫入時等待鎖，而不是立即失敗
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> 'PriceStore':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def save_day(self, date: str, records: Iterable[Dict[str, Any]]) -> int:
+        """寫入單一日期的股價資料，回傳寫入筆數
+
+        High 與 Low 分析程式各自只帶有 ``high`` 或 ``low`` 欄位，因此採用
+        upsert 並以 COALESCE 保留另一個程式先前寫入的欄位。
+        """
+        rows = [
+            (date, rec['code'], rec.get('name'), rec.get('high'),
+             rec.get('low'), rec.get('close'))
+            for rec in records
+        ]
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO prices (date, code, name, high, low, close)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (date, code) DO UPDATE SET
+                    name  = COALESCE(excluded.name, name),
+                    high  = COALESCE(excluded.high, high),
+                    low   = COALESCE(excluded.low, low),
+                    close = COALESCE(excluded.close, close)
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def save_events(self, kind: str, results: Iterable[Dict[str, Any]],
+                    start: Optional[str] = None, end: Optional[str] = None) -> int:
+        """寫入 compare_highs/compare_prices 的比較結果，回傳寫入筆數
+
+        指定比較期間 ``start``~``end`` 時，會在同一個交易內先刪除該期間內此 kind
+        的舊事件，避免基準期間調整後新舊結果混在一起。
+        """
+        _check_kind(kind)
+        base_key, price_key = f'base_{kind}', kind
+        rows = [
+            (kind, item['date'], item['code'], item['name'], item['close'],
+             item[base_key], item[price_key])
+            for item in results
+        ]
+        with self.conn:
+            if start is not None and end is not None:
+                self.conn.execute(
+                    'DELETE FROM events WHERE kind = ? AND date BETWEEN ? AND ?',
+                    (kind, start, end),
+                )
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO events
+                    (kind, date, code, name, close, base, price)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        return len(rows)
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+        """執行任意 SQL 查詢並以 dict 清單回傳結果"""
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def stored_dates(self, kind: Optional[str] = None) -> List[str]:
+        """回傳已存入的日期；指定 kind 時只算該欄位有值的日期"""
+        if kind is None:
+            sql = 'SELECT DISTINCT date FROM prices ORDER BY date'
+        else:
+            _check_kind(kind)
+            sql = f'SELECT DISTINCT date FROM prices WHERE {kind} IS NOT NULL ORDER BY date'
+        return [row[0] for row in self.conn.execute(sql)]
+
+    def load_day(self, date: str) -> List[Dict[str, Any]]:
+        """讀取單一日期的股價資料"""
+        return self.query(
+            'SELECT code, name, high, low, close FROM prices WHERE date = ? ORDER BY code',
+            (date,),
+        )
+
+    def base_extremes(self, kind: str, start: str, end: str) -> Dict[str, Dict[str, Any]]:
+        """以 SQL 計算基準期間每檔股票的最高/最低價
+
+        回傳格式與 ``record_highest_prices``/``record_lowest_prices`` 相同：
+        ``{code: {kind: price, 'date': date, 'name': name}}``。同價時取最早日期。
+        """
+        _check_kind(kind)
+        agg = 'MAX' if kind == 'high' else 'MIN'
+        rows = self.conn.execute(
+            f"""
+            WITH ext AS (
+                SELECT code, {agg}({kind}) AS price
+                FROM prices
+                WHERE date BETWEEN ? AND ? AND {kind} IS NOT NULL
+                GROUP BY code
+            )
+            SELECT p.code, MIN(p.date) AS date, p.name, ext.price
+            FROM prices p JOIN ext ON p.code = ext.code AND p.{kind} = ext.price
+            WHERE p.date BETWEEN ? AND ?
+            GROUP BY p.code
+            """,
+            (start, end, start, end),
+        )
+        return {
+            row['code']: {kind: row['price'], 'date': row['date'], 'name': row['name']}
+            for row in rows
+        }
+
+    def events(self, kind: str, start: Optional[str] = None, end: Optional[str] = None,
+               code: Optional[str] = None, min_close: Optional[float] = None,
+               max_close: Optional[float] = None) -> List[Dict[str, Any]]:
+        """依條件查詢創新高/低事件，例如比較期間內收盤價高於 X 的創新低股票"""
+        _check_kind(kind)
+        clauses = ['kind = ?']
+        params: List[Any] = [kind]
+        for clause, value in (
+            ('date >= ?', start),
+            ('date <= ?', end),
+            ('code = ?', code),
+            ('close > ?', min_close),
+            ('close < ?', max_close),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return self.query(
+            'SELECT date, code, name, close, base, price FROM events WHERE '
+            + ' AND '.join(clauses) + ' ORDER BY date, code',
+            params,
+        )
+
+
+def _check_kind(kind: str) -> None:
+    if kind not in KINDS:
+        raise ValueError(f'kind must be one of {KINDS}, got {kind!r}')
+
+
+def main() -> None:
+    """Run an ad hoc SQL query: ``python price_store.py output/stock_prices.db "SELECT ..."``."""
+    if len(sys.argv) != 3:
+        print('使用方式:')
+        print('  python price_store.py <資料庫路徑> "<SQL 查詢>"')
+        sys.exit(1)
+    with PriceStore(sys.argv[1]) as store:
+        for row in store.query(sys.argv[2]):
+            print(','.join('' if v is None else str(v) for v in row.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,40 @@
+import argparse
 import csv
 import io
 import os
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
-import json
+from typing import Dict, List, Any, Optional
 
-import requests
 from openpyxl import Workbook
 
+import aggregates
+import backfill_state
+from cache_io import InvalidCacheError, append_ledger, read_ledger
+from cache_manager import POLICIES as CACHE_POLICIES, CacheManager
+import data_sources
+import log_utils
+import parquet_export
+from leaderboard import DEFAULT_TOP_K, Leaderboard
+from price_store import PriceStore
+
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
 LOG_FILE = os.path.join(OUTPUT_DIR, 'stock_price_analyzer_low.log')
 DOWNLOADED_DATES_FILE = os.path.join(OUTPUT_DIR, 'downloaded_dates_low.txt')
 CACHE_DIR = os.path.join(OUTPUT_DIR, 'cache_low')
+DB_FILE = os.path.join(OUTPUT_DIR, 'stock_prices.db')
+# 快取記錄必須具備的欄位，用來判斷快取檔是否完整
+CACHE_KEYS = ('code', 'name', 'low', 'close')
+CACHE = CacheManager(CACHE_DIR, DOWNLOADED_DATES_FILE, CACHE_KEYS)
 
 
-def setup_logging() -> None:
+def setup_logging(json_logs: bool = False) -> None:
     """Configure logging to file and console."""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if json_logs:
+        # 背景 queue 寫入輪替的 JSON Lines，逐日訊息彙整為進度摘要
+        log_utils.setup_queue_logging(os.path.splitext(LOG_FILE)[0] + '.jsonl')
+        return
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s %(message)s',
@@ -48,20 +65,24 @@ COMPARE_DATES = generate_dates('20250526', '20250620')
 # Output filenames - 使用中文讓檔名更直觀
 RECORDS_FILE = f"台股最低價紀錄_{ALL_DATES[0]}_{ALL_DATES[-1]}.xlsx"
 COMPARISON_FILE = f"台股創新低比較_{COMPARE_DATES[0]}_{COMPARE_DATES[-1]}.xlsx"
+LEADERBOARD_FILE = f"台股創新低排行_{COMPARE_DATES[0]}_{COMPARE_DATES[-1]}.json"
 
 BASE_URL = 'https://www.twse.com.tw/exchangeReport/MI_INDEX?response=csv&date={date}&type=ALL'
 
 
+# 下載來源可替換為本機重播伺服器或 fixture，見 data_sources.py
+SOURCE = data_sources.create_source()
+
+
 def fetch_csv(date: str) -> str:
     """Download CSV text for the specified date."""
     url = BASE_URL.format(date=date)
     logging.info("Start download %s", date)
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+        content = SOURCE.get(url, timeout=10)
         logging.info("Downloaded %s", date)
         # TWSE files use Big5 (CP950) encoding
-        return response.content.decode('cp950', errors='ignore')
+        return content.decode('cp950', errors='ignore')
     except Exception as exc:
         logging.error("Failed to download %s: %s", date, exc)
         return ''
@@ -96,12 +117,14 @@ def parse_csv(text: str) -> List[Dict[str, Any]]:
     return records
 
 
-def fetch_records(date: str, downloaded_dates: set) -> List[Dict[str, Any]]:
+def fetch_records(date: str, downloaded_dates: set,
+                  store: Optional[PriceStore] = None) -> List[Dict[str, Any]]:
     """下載並解析指定日期的股票資料
     
     Args:
         date: 要下載的日期 (YYYYMMDD)
         downloaded_dates: 已下載的日期集合
+        store: 選用的 SQLite 資料庫，新下載的資料會一併寫入
     
     Returns:
         該日期的股票記錄清單
@@ -114,6 +137,12 @@ def fetch_records(date: str, downloaded_dates: set) -> List[Dict[str, Any]]:
             return cached_records
         else:
             logging.warning("快取資料不存在，重新下載: %s", date)
+    else:
+        # 其他分析程序可能在本程序載入記錄檔之後才完成下載
+        cached_records = load_cache_data(date)
+        if cached_records:
+            downloaded_dates.add(date)
+            return cached_records
     
     # 下載新資料
     text = fetch_csv(date)
@@ -127,6 +156,8 @@ def fetch_records(date: str, downloaded_dates: set) -> List[Dict[str, Any]]:
             downloaded_dates.add(date)
         # 儲存到快取
         save_cache_data(date, records)
+        if store is not None:
+            store.save_day(date, records)
     
     return records
 
@@ -146,8 +177,11 @@ def record_lowest_prices(all_records: Dict[str, List[Dict[str, Any]]], dates: Li
     return lowest
 
 
-def compare_prices(lowest: Dict[str, Dict[str, Any]], all_records: Dict[str, List[Dict[str, Any]]], dates: List[str]) -> List[Dict[str, Any]]:
+def compare_prices(lowest: Dict[str, Dict[str, Any]], all_records: Dict[str, List[Dict[str, Any]]], dates: List[str],
+                   leaderboard: Optional[Leaderboard] = None) -> List[Dict[str, Any]]:
     results: List[Dict[str, Any]] = []
+    # 排行需要「距前一次低點」的幅度，另外追蹤比較期間的最低價 (不影響事件判斷)
+    current_lowest: Dict[str, float] = {c: info['low'] for c, info in lowest.items()}
     for date in dates:
         records = all_records.get(date, [])
         record_map = {r['code']: r for r in records}
@@ -156,14 +190,18 @@ def compare_prices(lowest: Dict[str, Dict[str, Any]], all_records: Dict[str, Lis
             if not today:
                 continue  # No trading data for this stock on the date
             if today['low'] < info['low']:
-                results.append({
+                event = {
                     'date': date,
                     'code': code,
                     'name': info['name'],
                     'close': today['close'],
                     'base_low': info['low'],
                     'low': today['low'],
-                })
+                }
+                results.append(event)
+                if leaderboard is not None:
+                    leaderboard.push(event, current_lowest[code])
+                current_lowest[code] = min(current_lowest[code], today['low'])
     return results
 
 
@@ -217,8 +255,7 @@ def load_downloaded_dates() -> set:
         return set()
     
     try:
-        with open(DOWNLOADED_DATES_FILE, 'r', encoding='utf-8') as f:
-            downloaded_dates = {line.strip() for line in f if line.strip()}
+        downloaded_dates = read_ledger(DOWNLOADED_DATES_FILE)
         logging.info("載入 %d 筆已下載日期記錄", len(downloaded_dates))
         return downloaded_dates
     except Exception as e:
@@ -227,55 +264,142 @@ def load_downloaded_dates() -> set:
 
 
 def save_downloaded_date(date: str) -> None:
-    """將新下載的日期追加到記錄檔案中"""
+    """將新下載的日期追加到記錄檔案中 (跨程序加鎖，不重複寫入)"""
     try:
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        with open(DOWNLOADED_DATES_FILE, 'a', encoding='utf-8') as f:
-            f.write(f"{date}\n")
-        logging.info("記錄已下載日期: %s", date)
+        if append_ledger(DOWNLOADED_DATES_FILE, date):
+            logging.info("記錄已下載日期: %s", date)
     except Exception as e:
         logging.error("寫入已下載日期記錄失敗: %s", e)
 
 
-def save_cache_data(date: str, records: List[Dict[str, Any]]) -> None:
-    """將下載的資料快取到本地檔案"""
+def save_cache_data(date: str, records: List[Dict[str, Any]]) -> bool:
+    """將下載的資料快取到本地檔案 (暫存檔 + rename，避免寫到一半的檔案)"""
     try:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        cache_file = os.path.join(CACHE_DIR, f"{date}.json")
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(records, f, ensure_ascii=False, indent=2)
+        CACHE.put(date, records)
         logging.info("快取資料儲存成功: %s", date)
+        return True
     except Exception as e:
         logging.error("快取資料儲存失敗 %s: %s", date, e)
+        return False
 
 
 def load_cache_data(date: str) -> List[Dict[str, Any]]:
-    """從本地快取讀取資料"""
+    """從快取讀取資料 (先查記憶體 LRU)，內容不完整時視為沒有快取"""
     try:
-        cache_file = os.path.join(CACHE_DIR, f"{date}.json")
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                records = json.load(f)
-            logging.info("從快取載入 %d 筆記錄: %s", len(records), date)
-            return records
+        records = CACHE.get(date)
+    except InvalidCacheError as e:
+        logging.warning("快取資料無效，將重新下載 %s: %s", date, e)
         return []
     except Exception as e:
         logging.error("快取資料讀取失敗 %s: %s", date, e)
         return []
+    if records is None:
+        return []
+    logging.info("從快取載入 %d 筆記錄: %s", len(records), date)
+    return records
 
 
-def main():
-    setup_logging()
-    
+def sync_store(store: PriceStore, valid_records: Dict[str, List[Dict[str, Any]]]) -> None:
+    """將快取中已有、但資料庫尚未收錄的日期補寫進 SQLite"""
+    stored = set(store.stored_dates('low'))
+    missing = [date for date in sorted(valid_records) if date not in stored]
+    for date in missing:
+        store.save_day(date, valid_records[date])
+    if missing:
+        logging.info("補寫 %d 個日期到資料庫 %s", len(missing), store.path)
+
+
+def yyyymmdd(value: str) -> str:
+    """argparse 型別：驗證 YYYYMMDD 日期並回傳正規化的字串"""
+    try:
+        return datetime.strptime(value, '%Y%m%d').strftime('%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'日期格式必須是 YYYYMMDD: {value!r}')
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='分析上市股票創新低')
+    parser.add_argument(
+        '--db', nargs='?', const=DB_FILE, default=None, metavar='PATH',
+        help='同時寫入 SQLite 資料庫，並以 SQL 計算基準期間低點 (未指定路徑時使用 %(const)s)',
+    )
+    parser.add_argument(
+        '--export', choices=sorted(parquet_export.FORMATS), default=None,
+        help='另將價格歷史與比較結果匯出為依月份分割的 Parquet 或 Arrow IPC 資料集',
+    )
+    parser.add_argument(
+        '--top-k', type=int, default=DEFAULT_TOP_K, metavar='K',
+        help='每個日期依跌破幅度保留前 K 名輸出排行 JSON (預設 %(default)s，0 表示不輸出)',
+    )
+    parser.add_argument(
+        '--source', default=None,
+        help='資料來源: http (預設)、http://HOST:PORT (本機重播伺服器) 或 fixture[:選項]',
+    )
+    parser.add_argument(
+        '--log-json', action='store_true',
+        help='以背景執行緒寫入輪替的 JSON Lines log (.jsonl)，逐日訊息彙整為定期進度摘要',
+    )
+    cache = parser.add_argument_group('快取保留策略')
+    cache.add_argument('--cache-max-mb', type=float, default=None,
+                       help='快取目錄容量上限 (MB)，超過時依 --cache-policy 刪除日期')
+    cache.add_argument('--cache-max-age-days', type=int, default=None,
+                       help='刪除超過指定天數的快取日期')
+    cache.add_argument('--cache-keep-since', type=yyyymmdd, default=None,
+                       metavar='YYYYMMDD',
+                       help='刪除早於此日期的快取')
+    cache.add_argument('--cache-policy', choices=CACHE_POLICIES, default='oldest',
+                       help='超過容量時刪除最舊 (oldest) 或最久未使用 (lru) 的日期')
+    cache.add_argument('--cache-memory-mb', type=float, default=256,
+                       help='程序內記憶體快取上限 (MB，預設 %(default)s)')
+    args = parser.parse_args(argv)
+    if args.export and not parquet_export.available():
+        parser.error('--export 需要安裝 pyarrow: pip install pyarrow')
+    if args.top_k < 0:
+        parser.error('--top-k 必須是 0 或正整數')
+    for option in ('cache_max_mb', 'cache_max_age_days', 'cache_memory_mb'):
+        value = getattr(args, option)
+        if value is not None and value < 0:
+            parser.error(f"--{option.replace('_', '-')} 不可為負數")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    global SOURCE
+    args = parse_args(argv)
+    setup_logging(args.log_json)
+    if args.source:
+        SOURCE = data_sources.create_source(args.source)
+    CACHE.configure(
+        max_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb is not None else None,
+        max_age_days=args.cache_max_age_days,
+        keep_since=args.cache_keep_since,
+        policy=args.cache_policy,
+        memory_limit=int(args.cache_memory_mb * 1024 * 1024),
+    )
+    store = PriceStore(args.db) if args.db else None
+    try:
+        run_analysis(args, store)
+    finally:
+        if store is not None:
+            store.close()
+
+
+def run_analysis(args: argparse.Namespace, store: Optional[PriceStore]) -> None:
     # 在程式開始時載入已下載的日期記錄 (只讀取一次)
     downloaded_dates = load_downloaded_dates()
     
+    # backfill.py 已確認為休市的日期不再重複請求
+    holidays = (backfill_state.empty_dates() - downloaded_dates) & set(ALL_DATES)
+    
     # 過濾出需要下載的日期
-    dates_to_download = [date for date in ALL_DATES if date not in downloaded_dates]
+    dates_to_download = [date for date in ALL_DATES
+                         if date not in downloaded_dates and date not in holidays]
     
     logging.info("總共需要處理 %d 個日期", len(ALL_DATES))
     logging.info("已下載過的日期: %d 個", len(downloaded_dates & set(ALL_DATES)))
     logging.info("需要新下載的日期: %d 個", len(dates_to_download))
+    if holidays:
+        logging.info("略過已知休市日: %d 個", len(holidays))
     
     if dates_to_download:
         logging.info("開始下載新日期: %s", dates_to_download)
@@ -285,7 +409,10 @@ def main():
     # 下載資料：已下載的日期會被跳過，只下載新的日期
     all_records = {}
     for date in ALL_DATES:
-        records = fetch_records(date, downloaded_dates)
+        if date in holidays:
+            all_records[date] = []
+            continue
+        records = fetch_records(date, downloaded_dates, store)
         all_records[date] = records
     
     # 過濾出有資料的記錄進行分析
@@ -297,13 +424,41 @@ def main():
     
     logging.info("有效資料日期數: %d", len(valid_records))
     
-    lowest = record_lowest_prices(valid_records, BASE_DATES)
+    if store is not None:
+        sync_store(store, valid_records)
+        lowest = store.base_extremes('low', BASE_DATES[0], BASE_DATES[-1])
+    else:
+        lowest = record_lowest_prices(valid_records, BASE_DATES)
 
     # Save raw trading data covering April到六月初期間
     save_price_records(valid_records, RECORDS_FILE)
 
-    comparison = compare_prices(lowest, valid_records, COMPARE_DATES)
+    leaderboard = Leaderboard('low', args.top_k) if args.top_k else None
+    comparison = compare_prices(lowest, valid_records, COMPARE_DATES, leaderboard)
     save_comparison(comparison)
+    if leaderboard is not None:
+        path = os.path.join(OUTPUT_DIR, LEADERBOARD_FILE)
+        leaderboard.save(path)
+        logging.info("Saved top %d leaderboard to %s", leaderboard.k, path)
+    compared_dates = [date for date in COMPARE_DATES if date in valid_records]
+    folded = aggregates.update_aggregates(
+        'low', comparison, compared_dates, f"{BASE_DATES[0]}-{BASE_DATES[-1]}"
+    )
+    logging.info("Updated aggregates for %d dates in %s", len(folded), aggregates.AGGREGATES_FILE)
+    if store is not None:
+        store.save_events('low', comparison, COMPARE_DATES[0], COMPARE_DATES[-1])
+    if args.export:
+        try:
+            roots = parquet_export.export_analysis(
+                OUTPUT_DIR, 'low', valid_records, comparison, args.export
+            )
+            logging.info('Exported %s datasets to %s', args.export, ', '.join(roots))
+        except Exception as e:
+            logging.error('匯出 %s 資料集失敗: %s', args.export, e)
+    # 依保留策略清理快取，本次分析需要的日期不會被刪除
+    CACHE.enforce_retention(protect=ALL_DATES)
+    if SOURCE.stats.requests:
+        logging.info('Download stats (%s): %s', SOURCE.name, SOURCE.stats.summary())
     logging.info("Analysis complete")
 
 